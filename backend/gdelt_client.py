@@ -6,17 +6,65 @@ Cliente robusto para GDELT (ArtList CSV).
 """
 
 from __future__ import annotations
+import asyncio
 import csv
+import hashlib
 import io
-import ssl
 import urllib.parse
-import urllib.request
-from typing import List, Dict, Tuple
+from functools import lru_cache
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterator, Tuple
 from urllib.parse import urlparse
 
+import httpx
+
+# ---------- Hash de contenido (opcional: xxhash) ----------
+try:
+    from xxhash import xxh3_64_digest as _digest
+except Exception:
+    def _digest(data: bytes) -> bytes:
+        return hashlib.blake2b(data, digest_size=8).digest()
+
 BASE = "https://api.gdeltproject.org/api/v2/doc/doc"
 
+# Cliente HTTP async compartido: reutiliza el socket TCP y la sesión TLS entre polls
+# (keep-alive, HTTP/2) y no bloquea el event loop mientras espera a GDELT.
+_CLIENT: httpx.AsyncClient | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Devuelve el cliente HTTP compartido (o el inyectado con set_client).
+    Se crea perezosamente, dentro del event loop que lo va a usar.
+    """
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = httpx.AsyncClient(
+            timeout=12.0,
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=2,
+                limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+            ),
+        )
+    return _CLIENT
+
+
+def set_client(client: httpx.AsyncClient | None) -> None:
+    """
+    Reemplaza el cliente compartido, p. ej. por uno con httpx.MockTransport en tests.
+    Con None, el próximo get_client() vuelve a crear el cliente por defecto.
+    """
+    global _CLIENT
+    _CLIENT = client
+
+
+# Por URL: (ETag, Last-Modified, hash del último cuerpo) para no re-parsear
+# respuestas que no cambiaron entre polls.
+_last_seen: Dict[str, Tuple[str | None, str | None, bytes]] = {}
+
 
+@lru_cache(maxsize=8)
 def build_gdelt_url(
     query: str,
     maxrecords: int = 100,
@@ -34,56 +82,45 @@ def build_gdelt_url(
     return f"{BASE}?{urllib.parse.urlencode(params)}"
 
 
-def _pick_key(header_map: Dict[str, str], *candidates: str) -> str | None:
-    for cand in candidates:
-        c = cand.lower()
-        if c in header_map:
-            return header_map[c]
-    return None
-
+# Nombres candidatos (en minúsculas) para cada campo, en orden de preferencia
+_URL_COLS   = ("url", "sourceurl", "documentidentifier", "link")
+_TITLE_COLS = ("title", "documenttitle", "alttitle")
+_DATE_COLS  = ("date", "timestamp", "sqldate", "dateadded")
+_LANG_COLS  = ("language", "doclanguage")
+_DOM_COLS   = ("domain",)
 
-def fetch_csv(
-    query: str,
-    timeout: int = 12,
-    maxrecords: int = 120,
-    timespan: str = "12h",
-    debug: bool = False,
-) -> Tuple[List[Dict[str, str]], int]:
-    """
-    Descarga y parsea el CSV de GDELT.
-    Retorna (rows, raw_len_bytes).
-    """
-    url = build_gdelt_url(query, maxrecords=maxrecords, timespan=timespan)
-    ctx = ssl.create_default_context()
 
-    with urllib.request.urlopen(url, timeout=timeout, context=ctx) as r:
-        raw_bytes = r.read()
-    raw = raw_bytes.decode("utf-8", errors="ignore")
+def _pick_idx(header_idx: Dict[str, int], candidates: Tuple[str, ...]) -> int:
+    for cand in candidates:
+        if cand in header_idx:
+            return header_idx[cand]
+    return -1
 
-    if debug:
-        try:
-            with open("last_gdelt.csv", "w", encoding="utf-8") as f:
-                f.write(raw)
-        except Exception:
-            pass
 
-    reader = csv.DictReader(io.StringIO(raw))
-    rows: List[Dict[str, str]] = []
+def parse_csv(raw_bytes: bytes) -> Iterator[Dict[str, str]]:
+    """Parsea el CSV ArtList de GDELT y genera filas normalizadas."""
+    # utf-8-sig: GDELT antepone un BOM que, si no, queda pegado al primer encabezado
+    reader = csv.reader(io.StringIO(raw_bytes.decode("utf-8-sig", errors="ignore"), newline=""))
+    header = next(reader, None) or []
+    header_idx = {name.strip().lower(): i for i, name in enumerate(header)}
 
-    header_map = {k.lower(): k for k in (reader.fieldnames or [])}
+    # Índices de columna resueltos una sola vez por respuesta
+    url_i, title_i, date_i, lang_i, dom_i = (
+        _pick_idx(header_idx, cols)
+        for cols in (_URL_COLS, _TITLE_COLS, _DATE_COLS, _LANG_COLS, _DOM_COLS)
+    )
 
-    url_key   = _pick_key(header_map, "URL", "SourceURL", "DocumentIdentifier", "Link")
-    title_key = _pick_key(header_map, "Title", "DocumentTitle", "AltTitle")
-    date_key  = _pick_key(header_map, "Date", "Timestamp", "SQLDate", "DateAdded", "DATE")
-    lang_key  = _pick_key(header_map, "Language", "DocLanguage")
-    dom_key   = _pick_key(header_map, "Domain")
+    # Atajos locales para el loop caliente (evita lookups de atributo por fila)
+    _strip = str.strip
+    _lower = str.lower
 
     for row in reader:
-        title  = (row.get(title_key, "") if title_key else "").strip()
-        urlval = (row.get(url_key, "")   if url_key   else "").strip()
-        date   = (row.get(date_key, "")  if date_key  else "").strip()
-        lang   = (row.get(lang_key, "")  if lang_key  else "").strip().lower()
-        domain = (row.get(dom_key, "")   if dom_key   else "").strip().lower()
+        n = len(row)
+        title  = _strip(row[title_i]) if 0 <= title_i < n else ""
+        urlval = _strip(row[url_i])   if 0 <= url_i   < n else ""
+        date   = _strip(row[date_i])  if 0 <= date_i  < n else ""
+        lang   = _lower(_strip(row[lang_i])) if 0 <= lang_i < n else ""
+        domain = _lower(_strip(row[dom_i]))  if 0 <= dom_i  < n else ""
 
         if not domain and urlval.startswith("http"):
             try:
@@ -94,12 +131,69 @@ def fetch_csv(
         if not title and not urlval:
             continue
 
-        rows.append({
+        yield {
             "date": date,          # p.ej. '2025-09-26 19:50:22' o 'yyyymmddhhmmss'
             "title": title,
             "url": urlval,
             "domain": domain,      # puede venir vacío si no hay URL
             "language": lang,      # 'en', 'es', 'english', 'spanish'… (varía)
-        })
+        }
+
+
+DEBUG_DUMP_PATH = Path("last_gdelt.csv")
+
+
+def _dump_debug(raw_bytes: bytes) -> None:
+    """Guarda el último CSV crudo tal cual llegó (modo debug)."""
+    try:
+        DEBUG_DUMP_PATH.write_bytes(raw_bytes)
+    except Exception:
+        pass
+
+
+async def aiter_csv(
+    query: str,
+    timeout: int = 12,
+    maxrecords: int = 120,
+    timespan: str = "12h",
+    debug: bool = False,
+    stats: Dict[str, int] | None = None,
+) -> AsyncIterator[Dict[str, str]]:
+    """
+    Descarga el CSV de GDELT (sin bloquear el loop) y genera sus filas normalizadas.
+    Si la respuesta no cambió desde el último poll (304, o mismo contenido), no genera nada.
+    Si se pasa `stats`, deja ahí stats["raw_len"] (bytes descargados).
+    """
+    url = build_gdelt_url(query, maxrecords=maxrecords, timespan=timespan)
+
+    etag, last_modified, last_digest = _last_seen.get(url, (None, None, b""))
+    headers: Dict[str, str] = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    r = await get_client().get(url, timeout=timeout, headers=headers)
+    if r.status_code == 304:
+        if stats is not None:
+            stats["raw_len"] = 0
+        return
+    r.raise_for_status()
+    raw_bytes = r.content
+    if stats is not None:
+        stats["raw_len"] = len(raw_bytes)
+
+    # GDELT casi nunca manda ETag: comparamos un hash del cuerpo
+    digest = _digest(raw_bytes)
+    if digest == last_digest:
+        return
+
+    if debug:
+        # En un hilo aparte: la escritura a disco no frena el poll
+        asyncio.get_running_loop().run_in_executor(None, _dump_debug, raw_bytes)
+
+    for row in parse_csv(raw_bytes):
+        yield row
 
-    return rows, len(raw_bytes)
+    # Se registra recién al consumir todo, así un error a mitad no deja filas sin procesar
+    _last_seen[url] = (r.headers.get("ETag"), r.headers.get("Last-Modified"), digest)
@@ -2,13 +2,21 @@
 from __future__ import annotations
 
 import asyncio
+import multiprocessing as mp
+import os
+import queue
+import re
+import time
+from collections import deque
 from pathlib import Path
-from typing import Dict, List, Set
+from typing import Deque, Dict, Set, Tuple
 
+import orjson
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import FileResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi import FastAPI
+from starlette.middleware.gzip import GZipMiddleware
 
 app = FastAPI()
 
@@ -22,13 +30,36 @@ async def root_head():
     return ""
 
 
-from .news_poller import poll_news
+from .news_poller import run_poller_process
 
 app = FastAPI(title="News Alert App")
+# Comprime HTML/JS/CSS (y respuestas HTTP en general); no afecta al WebSocket
+app.add_middleware(GZipMiddleware, minimum_size=512)
 
 # --------- Frontend estático ----------
 FRONT_DIR = Path(__file__).resolve().parent.parent / "frontend"
-app.mount("/static", StaticFiles(directory=str(FRONT_DIR)), name="static")
+
+# Nombres tipo app.3f9a1c2e.js: el contenido nunca cambia para ese nombre
+_HASHED_NAME = re.compile(r"\.[0-9a-f]{8,}\.")
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles con Cache-Control explícito:
+    - assets con hash en el nombre: cache de un año, immutable.
+    - el resto: no-cache (el browser revalida con ETag/Last-Modified).
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        resp = super().file_response(full_path, stat_result, scope, status_code)
+        if _HASHED_NAME.search(os.path.basename(full_path)):
+            resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            resp.headers["Cache-Control"] = "no-cache"
+        return resp
+
+
+app.mount("/static", CachedStaticFiles(directory=str(FRONT_DIR)), name="static")
 
 @app.get("/", include_in_schema=False)
 def index():
@@ -37,13 +68,26 @@ def index():
 # --------- Estado global (WS + cola + historial) ----------
 news_queue: asyncio.Queue = asyncio.Queue()
 
-# Conexiones WebSocket actuales
-clients: Set[WebSocket] = set()
+# Conexiones WebSocket actuales, cada una con su cola de salida acotada.
+# Un cliente lento llena su cola y se lo desconecta, sin frenar al broadcaster.
+CLIENT_QUEUE_MAX = 256
+clients: Dict[WebSocket, asyncio.Queue] = {}
+# Referencias fuertes a tareas sueltas (el loop solo guarda referencias débiles)
+_bg_tasks: Set[asyncio.Task] = set()
 
 # Historial (se mantiene en memoria)
 MAX_HISTORY = 300  # cantidad máxima de tarjetas a recordar
-_history: List[Dict] = []
+# Cada entrada guarda (clave_dedup, evento) para no recalcular la clave al desalojar
+_history: Deque[Tuple[str, Dict]] = deque(maxlen=MAX_HISTORY)
 _seen_keys: Set[str] = set()  # para deduplicar rápido dentro del historial
+# Snapshot del historial ya serializado; se comparte entre conexiones nuevas
+# y se invalida cada vez que cambia el historial.
+_snapshot_cache: bytes | None = None
+
+
+def _dumps(obj: Dict) -> bytes:
+    """JSON en UTF-8 listo para el socket (orjson: más rápido y sin paso str→bytes)."""
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
 
 
 def _dedup_key(evt: Dict) -> str:
@@ -55,30 +99,61 @@ def _dedup_key(evt: Dict) -> str:
 
 def _push_history(evt: Dict) -> None:
     """Agrega al historial con deduplicación y límite."""
+    global _snapshot_cache
     key = _dedup_key(evt)
     if not key or key in _seen_keys:
         return
-    _history.append(evt)
+    # el deque desaloja solo el más viejo al llenarse; liberamos su clave antes
+    if len(_history) == MAX_HISTORY:
+        _seen_keys.discard(_history[0][0])
+    _history.append((key, evt))
     _seen_keys.add(key)
-    # recortar si nos pasamos
-    while len(_history) > MAX_HISTORY:
-        old = _history.pop(0)
-        _seen_keys.discard(_dedup_key(old))
+    _snapshot_cache = None
 
 
-async def _broadcast(evt: Dict) -> None:
-    """Envía el evento a todos los clientes conectados."""
-    dead: List[WebSocket] = []
-    for ws in list(clients):
-        try:
-            await ws.send_json(evt)
-        except Exception:
-            dead.append(ws)
-    for ws in dead:
+def _history_snapshot() -> bytes:
+    """Historial completo como un único mensaje {"type": "snapshot", "items": [...]}."""
+    global _snapshot_cache
+    if _snapshot_cache is None:
+        _snapshot_cache = _dumps({"type": "snapshot", "items": [evt for _, evt in _history]})
+    return _snapshot_cache
+
+
+async def _close_quietly(ws: WebSocket) -> None:
+    try:
+        await ws.close()
+    except Exception:
+        pass
+
+
+def _drop_client(ws: WebSocket) -> None:
+    """Saca al cliente del broadcast y cierra su socket (su handler limpia el resto)."""
+    if clients.pop(ws, None) is not None:
+        task = asyncio.create_task(_close_quietly(ws))
+        _bg_tasks.add(task)
+        task.add_done_callback(_bg_tasks.discard)
+
+
+async def _sender(ws: WebSocket, q: asyncio.Queue) -> None:
+    """Vacía la cola de un cliente hacia su socket."""
+    try:
+        while True:
+            payload = await q.get()
+            await ws.send_bytes(payload)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        _drop_client(ws)
+
+
+def _broadcast(evt: Dict) -> None:
+    """Encola el evento (serializado una sola vez) para todos los clientes conectados."""
+    payload = _dumps({"type": "event", **evt})
+    for ws, q in list(clients.items()):
         try:
-            clients.remove(ws)
-        except KeyError:
-            pass
+            q.put_nowait(payload)
+        except asyncio.QueueFull:
+            _drop_client(ws)
 
 
 async def broadcaster_task():
@@ -86,13 +161,63 @@ async def broadcaster_task():
     while True:
         evt = await news_queue.get()
         _push_history(evt)
-        await _broadcast(evt)
+        _broadcast(evt)
+        # get() no cede el loop si la cola tiene datos: cedemos para que los
+        # senders vacíen sus colas durante una ráfaga del poller
+        await asyncio.sleep(0)
+
+
+POLLER_RESTART_MAX_SEC = 300
+POLLER_HEALTHY_SEC = 60  # si el poller vivió más que esto, el backoff vuelve a empezar
+
+
+def _start_poller(ctx, ipc):
+    proc = ctx.Process(target=run_poller_process, args=(ipc,), name="news-poller", daemon=True)
+    proc.start()
+    return proc
+
+
+async def ipc_relay_task(ctx, ipc) -> None:
+    """
+    Pasa los eventos del proceso poller a la cola local del broadcaster.
+    Si el poller muere (OOM, crash en código C…), lo relanza con backoff.
+    """
+    backoff = 1
+    started = time.monotonic()
+    while True:
+        try:
+            # timeout corto: el hilo no queda colgado en get() al cancelar la tarea
+            evt = await asyncio.to_thread(ipc.get, True, 1.0)
+        except queue.Empty:
+            proc = app.state.poller_proc
+            if proc.is_alive():
+                continue
+            await asyncio.to_thread(proc.join)
+            if time.monotonic() - started > POLLER_HEALTHY_SEC:
+                backoff = 1
+            print(f"[POLL] el proceso poller terminó (exitcode={proc.exitcode}); se relanza en {backoff}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, POLLER_RESTART_MAX_SEC)
+            app.state.poller_proc = _start_poller(ctx, ipc)
+            started = time.monotonic()
+            continue
+        await news_queue.put(evt)
 
 
 @app.on_event("startup")
 async def _on_startup():
-    # Lanza el poller que pone eventos en la cola
-    app.state.poller_task = asyncio.create_task(poll_news(news_queue))
+    # Lanza el poller en su propio proceso (parseo/regex/langdetect no compiten
+    # por el GIL con el loop de los WebSocket); "spawn" evita forkear un loop corriendo.
+    # Ojo: cada worker de uvicorn tiene su propio historial y sus propios clientes,
+    # así que cada uno lanza su poller y GDELT recibe un poll por worker.
+    # Pensado para un solo worker (como en render.yaml).
+    if int(os.environ.get("WEB_CONCURRENCY", "1") or 1) > 1:
+        print("[POLL] aviso: con varios workers cada uno consulta GDELT por su cuenta")
+    ctx = mp.get_context("spawn")
+    app.state.ipc = ipc = ctx.Queue()
+    app.state.poller_proc = _start_poller(ctx, ipc)
+    # Trae los eventos del poller a la cola local (y lo relanza si se cae)
+    app.state.relay_task = asyncio.create_task(ipc_relay_task(ctx, ipc))
     # Lanza el broadcaster que reparte a los clientes y mantiene historial
     app.state.broadcast_task = asyncio.create_task(broadcaster_task())
 
@@ -100,34 +225,34 @@ async def _on_startup():
 @app.on_event("shutdown")
 async def _on_shutdown():
     # Cancelar tareas en un shutdown ordenado
-    for name in ("poller_task", "broadcast_task"):
+    for name in ("relay_task", "broadcast_task"):
         task = getattr(app.state, name, None)
         if task:
             task.cancel()
             try:
                 await task
-            except Exception:
+            except (asyncio.CancelledError, Exception):
                 pass
+    proc = getattr(app.state, "poller_proc", None)
+    if proc and proc.is_alive():
+        proc.terminate()
+        await asyncio.to_thread(proc.join, 5)
+    ipc = getattr(app.state, "ipc", None)
+    if ipc is not None:
+        ipc.close()
+        ipc.cancel_join_thread()
 
 
 @app.websocket("/ws/news")
 async def ws_news(ws: WebSocket):
     await ws.accept()
-    clients.add(ws)
 
-    # 1) Enviar primero el HISTORIAL existente (en orden del más viejo al más nuevo)
-    #    Si preferís solo los últimos K, cambiá el slice.
-    try:
-        for item in _history[-MAX_HISTORY:]:
-            await ws.send_json(item)
-    except Exception:
-        # si falla al enviar el historial, cerramos la conexión
-        try:
-            clients.remove(ws)
-        except KeyError:
-            pass
-        await ws.close()
-        return
+    # 1) El HISTORIAL existente va primero en la cola, en un solo mensaje
+    #    (items en orden del más viejo al más nuevo); después, los eventos en vivo.
+    q: asyncio.Queue = asyncio.Queue(maxsize=CLIENT_QUEUE_MAX)
+    q.put_nowait(_history_snapshot())
+    clients[ws] = q
+    sender = asyncio.create_task(_sender(ws, q))
 
     # 2) Mantener la conexión viva; no esperamos datos del cliente,
     #    solo detectamos el cierre.
@@ -138,7 +263,11 @@ async def ws_news(ws: WebSocket):
     except WebSocketDisconnect:
         pass
     finally:
+        clients.pop(ws, None)
+        sender.cancel()
         try:
-            clients.remove(ws)
-        except KeyError:
-            pass
+            await sender
+        except asyncio.CancelledError:
+            # solo tragamos la cancelación del sender, no la de este handler
+            if asyncio.current_task().cancelling():
+                raise
@@ -9,13 +9,13 @@ from __future__ import annotations
 import asyncio
 import datetime
 import re
-import urllib.request
-import xml.etree.ElementTree as ET
+from collections import OrderedDict
 from email.utils import parsedate_to_datetime
-from typing import List, Dict
+from functools import lru_cache
+from typing import Dict, List, Tuple
 from urllib.parse import urlparse
 
-from .gdelt_client import fetch_csv
+from .gdelt_client import aiter_csv, get_client
 
 # ---------- Detección de idioma (opcional) ----------
 try:
@@ -34,6 +34,22 @@ except Exception:
     def safe_detect_lang(text: str) -> str:
         return "unk"
 
+# ---------- Parser XML (opcional: lxml, en C) ----------
+try:
+    from lxml import etree as ET
+except Exception:
+    import xml.etree.ElementTree as ET  # misma API de XMLPullParser, más lenta
+
+# ---------- Filtro de vistos (opcional: Bloom) ----------
+try:
+    from pybloom_live import ScalableBloomFilter
+    def _new_bloom():
+        return ScalableBloomFilter(initial_capacity=10_000, error_rate=1e-4)
+except Exception:
+    # Sin pybloom_live usamos un set exacto (crece sin límite, como antes)
+    def _new_bloom():
+        return set()
+
 # ==========================
 # Config
 # ==========================
@@ -44,102 +60,171 @@ GDELT_QUERY = (
 POLL_INTERVAL_SEC = 30
 BATCH_MAX = 120
 TIMESPAN = "12h"
+DEBUG_DUMP = False  # True: guarda cada CSV crudo en last_gdelt.csv (solo para desarrollo)
 
 # Fallback RSS (si alguna vez querés activarlo)
 REUTERS_RSS = "https://feeds.reuters.com/reuters/businessNews"
 
-STOP_UPPER = {
+STOP_UPPER = frozenset({
     "THE","AND","FOR","WITH","FROM","THIS","THAT","WAS","WILL","HAVE","HAS",
     "USA","US","CEO","CFO","DOE","DOD","IPO","ETF","FDA","SEC","EU","UK",
     "LITHIUM","OIL","GAS","BANK","NEWS","MERGER","ACQUISITION","Q1","Q2","Q3","Q4"
-}
+})
 
-RE_GOV_STAKE = re.compile(r"\b(government|state)\b.*\b(stake|equity|share)\b", re.I)
-RE_CEO_RESIGN = re.compile(r"\b(CEO|CFO)\b.*\b(resigns?|steps down|resignation)\b", re.I)
-RE_MA         = re.compile(r"\b(acquisition|acquire|acquired|merger|merging|combine)\b", re.I)
-RE_EARNINGS   = re.compile(r"\b(earnings|guidance|EPS|revenue)\b", re.I)
-RE_CONTRACT   = re.compile(r"\b(contract|award|offtake|MoU)\b", re.I)
+RE_GOV_STAKE = re.compile(r"\b(?:government|state)\b.*\b(?:stake|equity|share)\b", re.I)
+RE_CEO_RESIGN = re.compile(r"\b(?:CEO|CFO)\b.*\b(?:resigns?|steps down|resignation)\b", re.I)
+RE_MA         = re.compile(r"\b(?:acquisition|acquire|acquired|merger|merging|combine)\b", re.I)
+RE_EARNINGS   = re.compile(r"\b(?:earnings|guidance|EPS|revenue)\b", re.I)
+RE_CONTRACT   = re.compile(r"\b(?:contract|award|offtake|MoU)\b", re.I)
 UPPER_TOKEN   = re.compile(r"\b[A-Z]{2,5}\b")
 
+# Palabras funcionales exclusivas de un idioma (nada como "is", "over", "will" o
+# "el", que también son holandés, alemán, catalán…): con 2 distintas, no hace falta langdetect
+RE_EN_STOPWORDS = re.compile(r"\b(the|and|with|from|says)\b", re.I)
+RE_ES_STOPWORDS = re.compile(r"\b(los|las|según|tras|hacia|aunque)\b", re.I)
+
+# Reglas de categoría, en orden de prioridad
+CATEGORY_RULES = (
+    ("GovStake", RE_GOV_STAKE),
+    ("CEOResignation", RE_CEO_RESIGN),
+    ("M&A", RE_MA),
+    ("Earnings", RE_EARNINGS),
+    ("Contract", RE_CONTRACT),
+)
+
 
 def iso_now_utc() -> str:
-    return datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return now.replace(microsecond=0, tzinfo=None).isoformat() + "Z"
 
 
-def to_iso_utc(date_str: str) -> str:
-    if not date_str:
-        return iso_now_utc()
+@lru_cache(maxsize=4096)
+def _parse_date_iso(date_str: str) -> str | None:
+    """Parsea una fecha de GDELT/ISO/RSS a ISO UTC. None si no se reconoce."""
     # 1) GDELT clásico yyyymmddhhmmss
-    try:
-        dt = datetime.datetime.strptime(date_str, "%Y%m%d%H%M%S")
-        return dt.isoformat() + "Z"
-    except Exception:
-        pass
-    # 2) 'YYYY-MM-DD HH:MM:SS'
+    if len(date_str) == 14 and date_str.isdigit():
+        try:
+            return datetime.datetime.strptime(date_str, "%Y%m%d%H%M%S").isoformat() + "Z"
+        except ValueError:
+            return None
+    # 2) ISO-8601, extendido o básico ('YYYY-MM-DD HH:MM:SS', '20250926T195022Z', …)
     try:
         dt = datetime.datetime.fromisoformat(date_str.replace(" ", "T"))
         if dt.tzinfo is None:
             return dt.isoformat() + "Z"
         return dt.astimezone(datetime.timezone.utc).isoformat()
-    except Exception:
+    except ValueError:
         pass
     # 3) RSS (RFC-2822)
     try:
-        dt = parsedate_to_datetime(date_str)
-        return dt.astimezone(datetime.timezone.utc).isoformat()
-    except Exception:
-        return iso_now_utc()
+        return parsedate_to_datetime(date_str).astimezone(datetime.timezone.utc).isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+def to_iso_utc(date_str: str, default: str | None = None) -> str:
+    # Las fechas vacías o irreconocibles caen en `default` (o "ahora"), que no debe quedar cacheado
+    if date_str:
+        parsed = _parse_date_iso(date_str)
+        if parsed:
+            return parsed
+    return default or iso_now_utc()
 
 
+@lru_cache(maxsize=2048)
 def classify(title: str) -> str:
     t = title or ""
-    if RE_GOV_STAKE.search(t): return "GovStake"
-    if RE_CEO_RESIGN.search(t): return "CEOResignation"
-    if RE_MA.search(t):         return "M&A"
-    if RE_EARNINGS.search(t):   return "Earnings"
-    if RE_CONTRACT.search(t):   return "Contract"
+    for name, rx in CATEGORY_RULES:
+        if rx.search(t):
+            return name
     return "News"
 
 
 def guess_tickers(title: str) -> List[str]:
+    return list(_guess_tickers_cached(title or ""))
+
+
+@lru_cache(maxsize=2048)
+def _guess_tickers_cached(title: str) -> Tuple[str, ...]:
+    # tupla: el valor cacheado es inmutable; guess_tickers devuelve una lista nueva
     seen, out = set(), []
-    for tok in UPPER_TOKEN.findall((title or "")):
-        if tok in STOP_UPPER:
+    stop, append = STOP_UPPER, out.append
+    for m in UPPER_TOKEN.finditer(title):
+        tok = m.group()
+        if tok in stop or tok in seen:
             continue
-        if tok not in seen and 2 <= len(tok) <= 5:
-            seen.add(tok); out.append(tok)
-    return out[:6]
+        seen.add(tok); append(tok)
+        if len(out) == 6:
+            break  # cortamos apenas tenemos los 6 tickers
+    return tuple(out)
 
 
-def fetch_reuters_rss(limit: int = 50) -> List[Dict[str, str]]:
+async def fetch_reuters_rss(limit: int = 50) -> List[Dict[str, str]]:
     try:
-        with urllib.request.urlopen(REUTERS_RSS, timeout=10) as r:
-            xml = r.read().decode("utf-8", errors="ignore")
-        root = ET.fromstring(xml)
-        items = root.findall(".//item")
         out: List[Dict[str, str]] = []
-        for it in items[:limit]:
-            title = (it.findtext("title") or "").strip()
-            link  = (it.findtext("link") or "").strip()
-            pub   = (it.findtext("{http://purl.org/dc/elements/1.1/}date")
-                     or it.findtext("pubDate") or "").strip()
-            dom = ""
-            try: dom = urlparse(link).netloc.lower()
-            except Exception: pass
-            out.append({
-                "date": pub,
-                "domain": dom or "reuters.com",
-                "language": "en",
-                "title": title or "(sin título)",
-                "url": link,
-                "ts": pub if pub else iso_now_utc(),
-            })
+        # Parseo en streaming: cada <item> se procesa al cerrarse y se libera
+        parser = ET.XMLPullParser(events=("end",))
+        async with get_client().stream("GET", REUTERS_RSS, timeout=10) as r:
+            r.raise_for_status()
+            async for chunk in r.aiter_bytes():
+                parser.feed(chunk)
+                for _, it in parser.read_events():
+                    if it.tag != "item":
+                        continue
+                    title = (it.findtext("title") or "").strip()
+                    link  = (it.findtext("link") or "").strip()
+                    pub   = (it.findtext("{http://purl.org/dc/elements/1.1/}date")
+                             or it.findtext("pubDate") or "").strip()
+                    it.clear()
+                    if hasattr(it, "getprevious"):  # lxml: soltar también los hermanos ya vistos
+                        while it.getprevious() is not None:
+                            del it.getparent()[0]
+                    dom = ""
+                    try: dom = urlparse(link).netloc.lower()
+                    except Exception: pass
+                    out.append({
+                        "date": pub,
+                        "domain": dom or "reuters.com",
+                        "language": "en",
+                        "title": title or "(sin título)",
+                        "url": link,
+                        "ts": pub if pub else iso_now_utc(),
+                    })
+                    if len(out) >= limit:
+                        return out
         return out
     except Exception as e:
         print("[RSS] error:", repr(e))
         return []
 
 
+class SeenFilter:
+    """
+    Dedup de dos niveles que reduce (no acota) la memoria del set de vistos:
+    - LRU exacto con las `recent_max` claves más recientes.
+    - Bloom (~10 bits por clave) solo para las claves que ya salieron del LRU;
+      es lo único que se consulta para ellas, así que ahí puede haber algún
+      falso positivo (una noticia nueva descartada), aceptable para alertas.
+    ScalableBloomFilter igual crece con el tiempo, y sin pybloom_live el
+    segundo nivel es un set exacto sin límite.
+    """
+
+    def __init__(self, recent_max: int = 2048):
+        self._recent: OrderedDict[str, None] = OrderedDict()
+        self._recent_max = recent_max
+        self._bloom = _new_bloom()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._recent or key in self._bloom
+
+    def add(self, key: str) -> None:
+        self._recent[key] = None
+        self._recent.move_to_end(key)
+        if len(self._recent) > self._recent_max:
+            old, _ = self._recent.popitem(last=False)
+            self._bloom.add(old)
+
+
 def normalize_lang(lang: str) -> str:
     """
     Devuelve 'es', 'en' u otro código (ej. 'ru', 'el', 'ta', 'unk').
@@ -153,12 +238,29 @@ def normalize_lang(lang: str) -> str:
     return l  # ru, el, ta, etc., o 'unk'
 
 
+def guess_lang(title: str) -> str:
+    """
+    Idioma de un título sin tag de idioma en el feed.
+    Primero una heurística barata por stopwords; langdetect solo si no alcanza.
+    """
+    t = title or ""
+    if t.isascii() and _distinct_hits(RE_EN_STOPWORDS, t) >= 2:
+        return "en"
+    if _distinct_hits(RE_ES_STOPWORDS, t) >= 2:
+        return "es"
+    return normalize_lang(safe_detect_lang(t))
+
+
+def _distinct_hits(rx: re.Pattern, text: str) -> int:
+    return len({m.lower() for m in rx.findall(text)})
+
+
 async def poll_news(queue: asyncio.Queue):
     """
     Encola TODO lo que llega y agrega 'domain' + 'language' (detectado).
     Dedup por URL o (titulo|fecha) si no hay URL.
     """
-    seen: set[str] = set()
+    seen = SeenFilter()
 
     # Seed inicial
     await queue.put({
@@ -178,30 +280,39 @@ async def poll_news(queue: asyncio.Queue):
     while True:
         try:
             # 1) GDELT
-            rows, raw_len = fetch_csv(
+            stats: Dict[str, int] = {}
+            rows = aiter_csv(
                 GDELT_QUERY,
                 timeout=12,
                 maxrecords=BATCH_MAX,
                 timespan=TIMESPAN,
-                debug=False,
+                debug=DEBUG_DUMP,
+                stats=stats,
             )
-            print(f"[GDELT] raw_bytes={raw_len} fetched={len(rows)}")
 
-            enq = 0
-            for r in rows:
+            # Primero dedup; después se enriquecen solo las filas nuevas
+            fresh: List[Tuple[str, str, str, str, str]] = []
+            fetched = 0
+            async for r in rows:
+                fetched += 1
                 title  = (r.get("title") or "").strip()
                 url    = (r.get("url") or "").strip()
                 date   = (r.get("date") or "").strip()
                 domain = (r.get("domain") or "").strip().lower()
                 lang_raw = (r.get("language") or "").strip().lower()
 
-                # Detectar idioma si no viene del feed
-                lang = normalize_lang(lang_raw) if lang_raw else normalize_lang(safe_detect_lang(title))
-
                 dedup_key = url or f"{title}|{date}"
                 if not dedup_key or dedup_key in seen:
                     continue
                 seen.add(dedup_key)
+                fresh.append((title, url, date, domain, lang_raw))
+
+            batch_now = iso_now_utc()  # un solo "ahora" para todo el lote
+
+            enq = 0
+            for title, url, date, domain, lang_raw in fresh:
+                # Detectar idioma si no viene del feed
+                lang = normalize_lang(lang_raw) if lang_raw else guess_lang(title)
 
                 event = {
                     "headline": title or "(sin título)",
@@ -209,19 +320,20 @@ async def poll_news(queue: asyncio.Queue):
                     "tickers": guess_tickers(title),
                     "category": classify(title),
                     "url": url,
-                    "ts": to_iso_utc(date),
+                    "ts": to_iso_utc(date, default=batch_now),
                     "domain": domain,
                     "language": lang,  # <<<<<< ESTE CAMPO ya llega al FRONT
                 }
                 await queue.put(event)
                 enq += 1
 
+            print(f"[GDELT] raw_bytes={stats.get('raw_len', 0)} fetched={fetched}")
             print(f"[GDELT] encoladas={enq}")
 
             # 2) (Opcional) Fallback Reuters si no llegó nada nuevo
             # Descomentar si querés fallback automáticamente
             # if enq == 0:
-            #     rss_items = fetch_reuters_rss(limit=40)
+            #     rss_items = await fetch_reuters_rss(limit=40)
             #     print(f"[RSS] fetched={len(rss_items)}")
             #     enq_rss = 0
             #     for it in rss_items:
@@ -251,3 +363,18 @@ async def poll_news(queue: asyncio.Queue):
             backoff = min(backoff * 2, 300)
 
         await asyncio.sleep(backoff)
+
+
+class _IPCQueue:
+    """Expone `await put(evt)` (como asyncio.Queue) sobre una multiprocessing.Queue."""
+
+    def __init__(self, ipc):
+        self._ipc = ipc
+
+    async def put(self, evt: Dict) -> None:
+        self._ipc.put(evt)
+
+
+def run_poller_process(ipc) -> None:
+    """Punto de entrada del proceso poller: corre poll_news con su propio event loop."""
+    asyncio.run(poll_news(_IPCQueue(ipc)))